@@ -2,8 +2,7 @@
 
 import os
 from fastapi import FastAPI, File, UploadFile, HTTPException
-import shutil
-from popocr import upload_file_to_s3, download_file_from_s3
+from popocr import upload_fileobj_to_s3, download_file_from_s3
 
 S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
 
@@ -14,20 +13,11 @@ async def upload(file: UploadFile = File(...)):
     # Use the S3_BUCKET_NAME from the environment variable
     bucket = S3_BUCKET_NAME
 
-    # Save the uploaded file to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_file_path = temp_file.name
-
     # Use the original filename as the object key
     object_key = file.filename
 
-    # Upload the temporary file to S3 using the original filename
-    try:
-        upload_file_to_s3(temp_file_path, bucket, object_key)
-    finally:
-        # Make sure to delete the temporary file
-        os.remove(temp_file_path)
+    # Stream the upload straight to S3, without a local copy
+    await upload_fileobj_to_s3(file.file, bucket, object_key)
 
     return {"filename": file.filename, "bucket": bucket, "object_key": object_key}
 
@@ -3,24 +3,101 @@ Convert image and PDF files into text/structured text
 
 Requires tesseract and poppler lambda layers
 - see https://github.com/jschaub30/lambda-layers
+
+The tesseract layer should ship eng.traineddata from tessdata_fast
+(https://github.com/tesseract-ocr/tessdata_fast) under /opt/share/tessdata_fast,
+or set TESSDATA_PREFIX to the directory holding it.
 """
 import boto3
 import os
 import json
 import tempfile
 import logging
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import subprocess
 from subprocess import TimeoutExpired, CalledProcessError
-from typing import Dict, Optional, Any
+from xml.etree import ElementTree
+from typing import Dict, List, Optional, Any
 from datetime import datetime
+from boto3.s3.transfer import TransferConfig
+from functools import lru_cache
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
-dynamodb = boto3.resource('dynamodb')
+try:
+    # Pillow is optional, without it images are passed to tesseract as is
+    from PIL import Image, ImageStat
+except ImportError:
+    Image = None
+
+# Lambda only has 1-2 vCPUs, where tesseract's OpenMP threads just contend with
+# each other. Run it single threaded instead.
+OMP_ENV = {"OMP_THREAD_LIMIT": "1", "OMP_NUM_THREADS": "1"}
+os.environ.update(OMP_ENV)
+
+# Scanned PDFs with at least this many pages are OCRed one process per page
+PARALLEL_OCR_MIN_PAGES = 2
+
+# Pages OCRed at once: $OCR_CONCURRENCY, or the number of CPUs if it isn't a number
+try:
+    OCR_CONCURRENCY = max(int(os.environ["OCR_CONCURRENCY"]), 1)
+except (KeyError, ValueError):
+    OCR_CONCURRENCY = os.cpu_count() or 1
+
+# The integer tessdata_fast models are several times faster than the default ones
+TESSDATA_DIR = os.environ.get("TESSDATA_PREFIX", "/opt/share/tessdata_fast")
+
+# Size the connection pool for the concurrent S3 transfers
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+)
+# S3 returns transient 503 SlowDown errors under load, so retry those harder
+S3_CONFIG = BOTO_CONFIG.merge(
+    Config(
+        retries={'max_attempts': 10, 'mode': 'adaptive'},
+        s3={'use_accelerate_endpoint': False, 'addressing_style': 'virtual'},
+    )
+)
+
 table_name = "DocumentConversionJobs"
-TABLE = dynamodb.Table(table_name)
 
-s3 = boto3.client('s3')
+
+@lru_cache(maxsize=1)
+def get_table():
+    """ return the jobs table, creating the DynamoDB resource on first use """
+    dynamodb = boto3.resource('dynamodb', config=BOTO_CONFIG)
+    return dynamodb.Table(table_name)
+
+
+s3 = boto3.client('s3', config=S3_CONFIG)
+
+# hocr classes that hold one line of text
+HOCR_LINE_CLASSES = {'ocr_line', 'ocr_caption', 'ocr_header', 'ocr_textfloat'}
+
+# Content types of the common uploads, so they don't need a head_object call
+EXT_TO_CONTENT_TYPE = {
+    '.pdf': 'application/pdf',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.tif': 'image/tiff',
+    '.tiff': 'image/tiff',
+}
+
+# Download scans over 4MB as concurrent 4MB range requests, written to disk in
+# 1MB chunks
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=4 * 1024 * 1024,
+    multipart_chunksize=4 * 1024 * 1024,
+    max_concurrency=20,
+    io_chunksize=1024 * 1024,
+    use_threads=True,
+)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -30,6 +107,11 @@ class SystemCallError(Exception):
     pass
 
 
+class UnsupportedFileError(Exception):
+    # Raised when the uploaded file is not an image or PDF
+    pass
+
+
 def run_command_with_timeout(command, timeout):
     """
     Runs a system command with a specified timeout. Raises SystemCallError if the command
@@ -39,8 +121,8 @@ def run_command_with_timeout(command, timeout):
     - command (list): The command to execute and its arguments as a list.
     - timeout (int): The timeout in seconds.
 
-    Returns:
-    - The output of the command if successful.
+    The command's stdout is discarded (all the commands write their results to files),
+    and stderr is only kept for the error message.
 
     Raises:
     - SystemCallError: If the command fails, times out, or returns a non-zero exit status.
@@ -48,16 +130,16 @@ def run_command_with_timeout(command, timeout):
     logger.info(f"Running command: {command}")
     try:
         result = subprocess.run(
-            command, capture_output=True, text=True, check=True, timeout=timeout
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+            check=True, timeout=timeout, env={**os.environ, **OMP_ENV}
         )
-        logger.info(result)
-        return result.stdout
+        logger.debug("rc=%d", result.returncode)
     except TimeoutExpired as e:
         raise SystemCallError(
             f"Command '{' '.join(command)}' timed out after {timeout} seconds"
         ) from e
     except CalledProcessError as e:
-        error_message = e.stderr.strip() if e.stderr else e.stdout.strip()
+        error_message = e.stderr.strip() if e.stderr else "no error output"
         raise SystemCallError(
             f"Command '{' '.join(command)}' failed with exit status {e.returncode}: {error_message}"
         ) from e
@@ -68,15 +150,18 @@ def run_command_with_timeout(command, timeout):
 
 
 def convert_image_tesseract(
-    image_filename: str, output_base_path: Optional[Path] = None, timeout: int = 60
-) -> str:
+    image_filenames: List[str], output_base_path: Optional[Path] = None, timeout: int = 60
+) -> Dict[str, str]:
     """
-    Converts an image file to a PDF using Tesseract OCR.
+    Converts one or more image files to PDF, text and hocr using Tesseract OCR.
+
+    All images are passed to a single tesseract process through a filelist, so the
+    language model is only loaded once, and each image becomes one page of the output.
 
     Args:
-        image_path (str): The path to the image file to convert.
+        image_filenames (List[str]): The paths to the image files to convert, in page order.
         output_base_path (str, optional): The basename where the output files should be saved.
-        If not specified, the PDF will be saved in the same location as the image.
+        If not specified, the output will be saved in the same location as the first image.
         timeout (int): The timeout in seconds for the Tesseract command.
 
     Returns:
@@ -85,18 +170,28 @@ def convert_image_tesseract(
     Raises:
         SystemCallError: If the Tesseract command fails, times out, or returns a non-zero exit code.
     """
-    image_path_obj = Path(image_filename)
-
     if output_base_path is None:
-        output_base_path = image_path_obj.with_suffix("")
+        output_base_path = Path(image_filenames[0]).with_suffix("")
     else:
         output_base_path = Path(output_base_path).with_suffix("")
 
+    # tesseract reads a list of images, one per line, from a text file
+    with tempfile.NamedTemporaryFile(
+        'w', suffix='.list', dir=output_base_path.parent, delete=False
+    ) as filelist:
+        filelist.write('\n'.join(image_filenames) + '\n')
+
     # Tesseract adds ".pdf" to the output base name itself
-    command = ["tesseract", image_filename, str(output_base_path), "pdf", "hocr", "txt"]
+    command = [
+        "tesseract", "--tessdata-dir", TESSDATA_DIR, "-c", "dotproduct=native",
+        filelist.name, str(output_base_path), "-l", "eng", "pdf", "hocr"
+    ]
 
     # Execute the command with a timeout
-    run_command_with_timeout(command, timeout)
+    try:
+        run_command_with_timeout(command, timeout)
+    finally:
+        os.remove(filelist.name)
 
     output = {}
     for ext in ('.pdf', '.txt', '.hocr'):
@@ -106,9 +201,117 @@ def convert_image_tesseract(
         else:
             key = ext.strip('.')
         output[key] = local_fn_pth
+
+    # The text is derived from the hocr, rather than having tesseract write it too
+    hocr_to_text(output['html'], output['txt'])
     return output
 
 
+def hocr_to_text(hocr_filename: str, txt_filename: str) -> str:
+    """
+    Extracts the plain text from a tesseract hocr file.
+
+    The layout matches tesseract's own txt output: words are separated by spaces,
+    lines by newlines, paragraphs by a blank line and pages by a form feed.
+
+    Args:
+        hocr_filename (str): The path to the hocr file.
+        txt_filename (str): The path where the text file should be saved.
+
+    Returns:
+        str: The path to the text file.
+    """
+    text = []
+    words = []
+    for _, elem in ElementTree.iterparse(hocr_filename, events=('end',)):
+        hocr_class = elem.get('class')
+        if hocr_class == 'ocrx_word':
+            words.append(''.join(elem.itertext()).strip())
+        elif hocr_class in HOCR_LINE_CLASSES:
+            text.append(' '.join(word for word in words if word) + '\n')
+            words = []
+            elem.clear()
+        elif hocr_class == 'ocr_par':
+            text.append('\n')
+        elif hocr_class == 'ocr_page':
+            text.append('\f')
+            elem.clear()
+
+    Path(txt_filename).write_text(''.join(text))
+    return txt_filename
+
+
+def binarize_image(image_filename: str) -> str:
+    """
+    Converts an image to a 1-bit, CCITT group 4 compressed TIFF for tesseract.
+
+    Tesseract then skips its own thresholding, and the much smaller file is also
+    what ends up embedded in the output PDF. Transparent images are flattened onto
+    white, then pixels brighter than 90% of the mean grey level become white.
+
+    Args:
+        image_filename (str): The path to the image file.
+
+    Returns:
+        str: The path to the binarized image, or the original path if Pillow is not
+        installed or can't handle the image (e.g. multi-page TIFFs).
+    """
+    if Image is None:
+        return image_filename
+
+    image_path_obj = Path(image_filename)
+    binary_filename = str(image_path_obj.with_name(f"{image_path_obj.stem}-bw.tif"))
+    try:
+        with Image.open(image_filename) as img:
+            if getattr(img, 'n_frames', 1) > 1:
+                return image_filename
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                # Transparent pixels are often stored as black, so put them on white
+                white = Image.new('RGBA', img.size, 'white')
+                gray = Image.alpha_composite(white, img.convert('RGBA')).convert('L')
+            else:
+                gray = img.convert('L')
+            threshold = ImageStat.Stat(gray).mean[0] * 0.9
+            binary = gray.point(lambda p: 255 if p > threshold else 0, mode='1')
+            binary.save(binary_filename, format='TIFF', compression='group4')
+    except OSError as e:
+        logger.warning(f"Could not binarize {image_filename}: {str(e)}")
+        return image_filename
+    return binary_filename
+
+
+def rasterize_pdf(
+    pdf_filename: str, output_dir: str, first_page: int = 1, last_page: int = 10,
+    timeout: int = 60
+) -> List[str]:
+    """
+    Renders PDF pages to JPEG images using the Poppler `pdftoppm` command.
+
+    Args:
+        pdf_filename (str): The path to the PDF file to render.
+        output_dir (str): The directory where the page images should be saved.
+        first_page (int): First page to render (default=1)
+        last_page (int): Last page to render (default=10)
+        timeout (int): The timeout in seconds for the `pdftoppm` command.
+
+    Returns:
+        list: The paths to the page images, in page order.
+    """
+    prefix = os.path.join(output_dir, "page")
+    command = [
+        "pdftoppm", "-r", "200", "-jpeg",
+        "-f", str(first_page), "-l", str(last_page),
+        pdf_filename, prefix
+    ]
+    try:
+        run_command_with_timeout(command, timeout)
+    except Exception as e:
+        raise SystemCallError(f"Failed to rasterize {pdf_filename}: {str(e)}")
+
+    # pdftoppm zero-pads the page numbers, so sorting by name keeps page order
+    return sorted(str(pth) for pth in Path(output_dir).glob("page-*.jpg"))
+
+
 def convert_pdf_poppler(
     pdf_filename: str, first_page: int = 1, last_page: int = 10, timeout: int = 60
 ) -> str:
@@ -124,26 +327,119 @@ def convert_pdf_poppler(
     Returns:
         dict: The path to the generated text file.
     """
-    output = {}
-    
-    # TXT output
+    commands = {}
     for ext in ('.txt', '.html'):
         output_filename = str(Path(pdf_filename).with_suffix(ext))
         command = ["pdftotext"]
         if ext == ".html":
             command.extend(['-bbox-layout'])
-    
+
         command.extend(["-f", str(first_page), "-l", str(last_page)])
         command.extend([pdf_filename, output_filename])
-        
+        commands[ext.strip('.')] = (command, output_filename)
+
+    # Both pdftotext runs are single threaded, so run them side by side
+    with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+        futures = {
+            fmt: executor.submit(run_command_with_timeout, command, timeout)
+            for fmt, (command, _) in commands.items()
+        }
+
+    output = {}
+    errors = []
+    for fmt, future in futures.items():
         try:
-            run_command_with_timeout(command, timeout)
+            future.result()
+            output[fmt] = commands[fmt][1]
         except Exception as e:
-            raise SystemCallError(f"Failed to convert {pdf_filename} to text: {str(e)}")
-        output[ext.strip('.')] = output_filename
+            errors.append(str(e))
+    if errors:
+        raise SystemCallError(f"Failed to convert {pdf_filename} to text: {'; '.join(errors)}")
 
     return output
-        
+
+
+def merge_hocr(hocr_filenames: List[str], output_filename: str) -> str:
+    """
+    Merges single page hocr files into one multi-page hocr file.
+
+    Every file tesseract writes numbers its page as page 1, so the element ids
+    and page numbers are rewritten to keep them unique in the merged document.
+
+    Args:
+        hocr_filenames (List[str]): The hocr files to merge, in page order.
+        output_filename (str): The path of the merged hocr file.
+
+    Returns:
+        str: The path to the merged hocr file.
+    """
+    pages = []
+    for page_num, hocr_filename in enumerate(hocr_filenames, start=1):
+        html = Path(hocr_filename).read_text()
+        if page_num == 1:
+            header = html[:html.index('<body>') + len('<body>')]
+        body = html[html.index('<body>') + len('<body>'):html.rindex('</body>')]
+        body = re.sub(r"id='([a-z]+)_1(?=[_'])", rf"id='\1_{page_num}", body)
+        body = body.replace('ppageno 0', f'ppageno {page_num - 1}')
+        pages.append(body)
+    Path(output_filename).write_text(header + ''.join(pages) + '</body>\n</html>\n')
+    return output_filename
+
+
+def process_pdf_parallel(
+    pdf_filename: str, first_page: int = 1, last_page: int = 10, timeout: int = 60
+) -> Dict[str, str]:
+    """
+    OCRs a scanned PDF by rendering its pages and running one tesseract per page.
+
+    Each tesseract runs single threaded (see OMP_ENV), so with several vCPUs the
+    pages are converted side by side, up to OCR_CONCURRENCY at once. Documents
+    with fewer than PARALLEL_OCR_MIN_PAGES pages, or a single worker, go through
+    one batched tesseract call instead.
+
+    Args:
+        pdf_filename (str): The path to the PDF file to convert.
+        first_page (int): First page to convert (default=1)
+        last_page (int): Last page to convert (default=10)
+        timeout (int): The timeout in seconds for each page.
+
+    Returns:
+        dict: dict with {extension: local_fn} e.g. {'xml': '/tmp/img.xml'}
+    """
+    pdf_path = Path(pdf_filename)
+    page_dir = pdf_path.with_name(f"{pdf_path.stem}-pages")
+    page_dir.mkdir(exist_ok=True)
+    output_base_path = pdf_path.with_name(f"{pdf_path.stem}-ocr")
+
+    images = rasterize_pdf(pdf_filename, str(page_dir), first_page, last_page, timeout)
+    workers = min(OCR_CONCURRENCY, len(images))
+    if len(images) < PARALLEL_OCR_MIN_PAGES or workers < 2:
+        return convert_image_tesseract(
+            images, output_base_path=output_base_path, timeout=timeout * len(images)
+        )
+
+    # Each worker just waits on its tesseract subprocess, so threads are enough
+    logger.info(f"Running OCR on {len(images)} pages with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = list(executor.map(
+            lambda image: convert_image_tesseract([image], timeout=timeout), images
+        ))
+
+    output = {}
+    output['pdf'] = str(output_base_path.with_suffix('.pdf'))
+    run_command_with_timeout(
+        ["pdfunite"] + [page['pdf'] for page in pages] + [output['pdf']], timeout
+    )
+    output['txt'] = str(output_base_path.with_suffix('.txt'))
+    with open(output['txt'], 'wb') as txt_file:
+        for page in pages:
+            with open(page['txt'], 'rb') as page_file:
+                shutil.copyfileobj(page_file, txt_file)
+    output['html'] = merge_hocr(
+        [page['html'] for page in pages], str(output_base_path.with_suffix('.hocr'))
+    )
+    return output
+
 
 def process_file(bucket_name: str, object_key: str, job_id, config: Dict[str, Any]):
     """
@@ -155,51 +451,75 @@ def process_file(bucket_name: str, object_key: str, job_id, config: Dict[str, An
         bucket_name (str): The name of the S3 bucket.
         object_key (str): The key of the object in the S3 bucket.
         config (Dict[str, Any]): Configuration options
+
+    Raises:
+        UnsupportedFileError: If the file is not an image or PDF. The error is
+        already recorded on the job.
     """
     logger.info(f"Start processing {object_key}")
     try:
-        head_response = s3.head_object(Bucket=bucket_name, Key=object_key)
-        content_type = head_response['ContentType']
+        content_type = EXT_TO_CONTENT_TYPE.get(Path(object_key).suffix.lower())
+        get_response = None
+        if content_type is None:
+            # A single GET gives us both the content type and the file
+            get_response = s3.get_object(Bucket=bucket_name, Key=object_key)
+            content_type = get_response['ContentType']
 
         # Check if the content type is allowed (image or PDF)
         if not (
             content_type == 'application/pdf' or content_type.startswith('image')
             ):
+            if get_response is not None:
+                get_response['Body'].close()
             message = f"File {object_key} is not an image or PDF, skipping processing."
             update_job(job_id, "error", message=message)
             logger.error(message)
-            return {
-                'statusCode': 400,
-                'body': message
-            }
+            raise UnsupportedFileError(message)
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_filename = f"{temp_dir}/{os.path.basename(object_key)}"
+        # /tmp is the only writable path in Lambda; the input, page images and
+        # all outputs live in this one directory
+        with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+            input_filename = os.path.join(temp_dir, os.path.basename(object_key))
             logger.info(f"Downloading from s3: {input_filename}")
-            s3.download_file(bucket_name, object_key, input_filename)
+            if get_response is not None:
+                with open(input_filename, 'wb') as input_file:
+                    shutil.copyfileobj(get_response['Body'], input_file, length=1024 * 1024)
+            else:
+                s3.download_file(bucket_name, object_key, input_filename, Config=TRANSFER_CONFIG)
 
             output_prefix = str(Path(object_key.replace('input', 'output', 1)).with_suffix(""))
             result = {}
             if content_type.startswith('image'):
                 # tesseract can do it all
-                output = convert_image_tesseract(input_filename)
+                output = convert_image_tesseract([binarize_image(input_filename)])
             else:
                 output = convert_pdf_poppler(input_filename)
-
-            # upload output files to S3
-            for fmt, local_fn_pth in output.items():
-                object_key = f"{output_prefix}.{fmt}"
-                logger.info(f"Uploading {local_fn_pth!r} to s3://{bucket_name}/{object_key}")
-                s3.upload_file(local_fn_pth, bucket_name, object_key)
-                result[fmt] = object_key
+                if not Path(output['txt']).read_text().strip():
+                    # No text layer, so this is a scanned (image-only) PDF
+                    logger.info(f"No text found in {input_filename}, running OCR")
+                    output = process_pdf_parallel(input_filename)
+
+            # upload output files to S3, all at once (the client is thread safe)
+            with ThreadPoolExecutor(max_workers=len(output)) as executor:
+                futures = {}
+                for fmt, local_fn_pth in output.items():
+                    output_key = f"{output_prefix}.{fmt}"
+                    logger.info(f"Uploading {local_fn_pth!r} to s3://{bucket_name}/{output_key}")
+                    future = executor.submit(s3.upload_file, local_fn_pth, bucket_name, output_key)
+                    futures[future] = (fmt, output_key)
+                for future in as_completed(futures):
+                    future.result()
+                    fmt, output_key = futures[future]
+                    result[fmt] = output_key
         return result
 
+    except UnsupportedFileError:
+        raise
     except Exception as e:
         message = f"Failed to process the file: {str(e)}"
         update_job(job_id, "error", message=message)
         logger.error(message)
         raise Exception(message)
-    return result
 
 
 def lambda_handler(event, context):
@@ -207,29 +527,33 @@ def lambda_handler(event, context):
     bucket_name = event['Records'][0]['s3']['bucket']['name']
     object_key = event['Records'][0]['s3']['object']['key']
     job_id = object_key.split("input/")[1].split("/")[0]
-    result = process_file(bucket_name, object_key, job_id, None)
     expiration_time_sec = 172800  # 2 days
-    urls = {}
-    try:
+
+    def presign(task):
+        ext, key = task
         url = s3.generate_presigned_url(
             ClientMethod='get_object',
             Params={
                 'Bucket': bucket_name,
-                'Key': object_key,
+                'Key': key,
             },
             ExpiresIn=expiration_time_sec,
         )
-        urls['input'] = url
-        for ext, object_key in result.items():
-            url = s3.generate_presigned_url(
-                ClientMethod='get_object',
-                Params={
-                    'Bucket': bucket_name,
-                    'Key': object_key,
-                },
-                ExpiresIn=expiration_time_sec,
-            )
-            urls[ext] = url
+        return ext, url
+
+    try:
+        result = process_file(bucket_name, object_key, job_id, None)
+    except UnsupportedFileError as e:
+        # The error is already recorded on the job
+        return {
+            'statusCode': 400,
+            'body': str(e)
+        }
+    tasks = [('input', object_key)] + list(result.items())
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            urls = dict(executor.map(presign, tasks))
         update_job(job_id, "success", urls=urls, message=None, metadata=None)
     except Exception as e:
         return {
@@ -255,7 +579,7 @@ def update_job(job_id, status, urls=None, message=None, metadata=None):
         if metadata:
             item['metadata'] = metadata
 
-        response = TABLE.put_item(Item=item)
+        get_table().put_item(Item=item)
         logger.info(f"Job {job_id} with status={status!r} updated successfully")
     except ClientError as e:
         logger.error(f"Error updating job record: {e.response['Error']['Message']}")
@@ -3,43 +3,87 @@ import json
 import boto3
 import os
 from datetime import datetime
+from functools import lru_cache
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import logging
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
+# Keep connections alive between warm invocations
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+)
+S3_CONFIG = BOTO_CONFIG.merge(
+    Config(
+        max_pool_connections=100,
+        signature_version='s3v4',
+        region_name=os.environ.get('AWS_REGION', 'us-east-1'),
+        s3={'use_accelerate_endpoint': False, 'addressing_style': 'virtual'},
+    )
+)
+
+# One session per container; the S3 client and DynamoDB resource share its
+# credentials, and warm invocations reuse the client built at import time
+session = boto3.Session()
+s3 = session.client('s3', config=S3_CONFIG)
+
+HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "POST,OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type"
+}
+
 table_name = "DocumentConversionJobs"
-TABLE = dynamodb.Table(table_name)
+
+
+@lru_cache(maxsize=1)
+def get_table():
+    """ return the jobs table, creating the DynamoDB resource on first use """
+    dynamodb = session.resource('dynamodb', config=BOTO_CONFIG)
+    return dynamodb.Table(table_name)
+
+
+def _dumps(obj) -> str:
+    """ serialize obj to a JSON string, using orjson when it is installed """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+# Static error bodies are serialized once at import
+_NO_BUCKET_BODY = _dumps({'message': "Bucket name not set in environment variables"})
+_MISSING_BODY = _dumps({'message': "Must provide 'filename' and 'content_type' in body"})
 
 
 def lambda_handler(event, context):
     bucket_name = os.environ.get('BUCKET_NAME')
-    
-    headers = {
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "POST,OPTIONS",
-        "Access-Control-Allow-Headers": "Content-Type"
-    }
 
     if not bucket_name:
         return {
             "statusCode": 500,
-            "headers": headers,
-            "body": json.dumps({'message': "Bucket name not set in environment variables"})
+            "headers": HEADERS,
+            "body": _NO_BUCKET_BODY
         }
 
     body = event.get('body')
 
     if isinstance(body, str):
-        body = json.loads(body)
+        body = orjson.loads(body) if orjson is not None else json.loads(body)
 
     if body is None or 'filename' not in body or 'content_type' not in body:
         return {
             'statusCode': 400,
-            "headers": headers,
-            'body': json.dumps({'message': "Must provide 'filename' and 'content_type' in body"})
+            "headers": HEADERS,
+            'body': _MISSING_BODY
         }
         
     # print(json.dumps(event))
@@ -52,12 +96,10 @@ def lambda_handler(event, context):
     object_key = f"input/{job_id}/{body['filename']}"
     content_type = body["content_type"]
     create_job(job_id, bucket_name, object_key)
-    
-    s3_client = boto3.client('s3')
 
     try:
         # Generate the presigned URL
-        presigned_url = s3_client.generate_presigned_url(
+        presigned_url = s3.generate_presigned_url(
             ClientMethod='put_object',
             Params={
                 'Bucket': bucket_name,
@@ -71,8 +113,8 @@ def lambda_handler(event, context):
         message = f'Error generating presigned URL: {str(e)}'
         return {
             'statusCode': 500,
-            'headers': headers,
-            'body': json.dumps({'message': message})
+            'headers': HEADERS,
+            'body': _dumps({'message': message})
         }
         update_job(job_id, "error", message=message)
     
@@ -82,8 +124,8 @@ def lambda_handler(event, context):
     }
     return {
         'statusCode': 200,
-        "headers": headers,
-        'body': json.dumps(result)
+        "headers": HEADERS,
+        'body': _dumps(result)
     }
 
 
@@ -100,7 +142,7 @@ def create_job(job_id, bucket_name, object_key, metadata=None):
         if metadata:
             item['metadata'] = metadata  # Add optional metadata field
 
-        response = TABLE.put_item(Item=item)
+        response = get_table().put_item(Item=item)
         logger.info(f"Job {job_id} created successfully")
     except ClientError as e:
         logger.error(f"Error creating job {job_id} record: {e.response['Error']['Message']}")
@@ -122,7 +164,7 @@ def update_job(job_id, status, urls=None, message=None, metadata=None):
         if metadata:
             item['metadata'] = metadata
 
-        response = TABLE.put_item(Item=item)
+        response = get_table().put_item(Item=item)
         logger.info(f"Job {job_id} with status={status!r} updated successfully")
     except ClientError as e:
         logger.error(f"Error updating job record: {e.response['Error']['Message']}")
@@ -1,20 +1,56 @@
 import json
 import logging
 import boto3
+from functools import lru_cache
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-dynamodb = boto3.resource('dynamodb')
+
+# Keep connections alive between warm invocations
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+)
 table_name = "DocumentConversionJobs"
-TABLE = dynamodb.Table(table_name)
+
+
+@lru_cache(maxsize=1)
+def get_table():
+    """ return the jobs table, creating the DynamoDB resource on first use """
+    dynamodb = boto3.resource('dynamodb', config=BOTO_CONFIG)
+    return dynamodb.Table(table_name)
+
+
+def _dumps(obj) -> str:
+    """ serialize obj to a JSON string, using orjson when it is installed """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
 
 def query_records_by_job_id(job_id):
     """ query records by job_id """
+    from boto3.dynamodb.conditions import Key
+
     try:
         # Query the table by the job_id (Partition Key)
-        response = TABLE.query(
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('job_id').eq(job_id)
+        # Only fetch the attributes lambda_handler reads; names that may be
+        # DynamoDB reserved words go through placeholders
+        response = get_table().query(
+            KeyConditionExpression=Key('job_id').eq(job_id),
+            ProjectionExpression="#s, created_at, #u, #m, #ur",
+            ExpressionAttributeNames={
+                "#s": "status", "#u": "url", "#m": "message", "#ur": "urls"
+            },
+            ConsistentRead=False,
         )
         # Return the records found
         logger.info(type(response))
@@ -38,7 +74,7 @@ def lambda_handler(event, context):
         return {
             'statusCode': 400,
             "headers": headers,
-            'body': json.dumps({'message': "Must provide 'job_id' as query parameter"})
+            'body': _dumps({'message': "Must provide 'job_id' as query parameter"})
         }
 
     job_id = query_params.get('job_id')
@@ -71,7 +107,7 @@ def lambda_handler(event, context):
         return {
             'statusCode': 200,
             "headers": headers,
-            "body": json.dumps({
+            "body": _dumps({
                 "job_id": job_id,
                 "status": status,
                 "message": message,
@@ -85,5 +121,5 @@ def lambda_handler(event, context):
         return {
             'statusCode': 200,
             "headers": headers,
-            "body": json.dumps({'message': f"Job {job_id!r} not found"})
+            "body": _dumps({'message': f"Job {job_id!r} not found"})
         }
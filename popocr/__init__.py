@@ -1 +1 @@
-from .storage import download_file_from_s3, upload_file_to_s3
+from .storage import download_file_from_s3, upload_file_to_s3, upload_fileobj_to_s3
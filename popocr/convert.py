@@ -3,7 +3,10 @@ Convert image and PDF files into text and/or structured text
 """
 
 import os
+import shutil
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import subprocess
 from subprocess import TimeoutExpired, CalledProcessError
@@ -11,6 +14,53 @@ from typing import Dict, Optional, Any
 import magic
 from .storage import download_file_from_s3, upload_file_to_s3
 
+# Optional in-process bindings (the "native" extra); without them we run the CLIs
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+try:
+    import pdftotext
+except ImportError:
+    pdftotext = None
+
+# tesseract's OpenMP threads slow it down on the few cores we run on
+OMP_ENV = {"OMP_THREAD_LIMIT": "1", "OMP_NUM_THREADS": "1"}
+os.environ.update(OMP_ENV)
+
+# Page ranges at least this long are converted one pdftotext process per page
+PARALLEL_MIN_PAGES = 2
+
+# Pages converted at once: $OCR_CONCURRENCY, or the number of CPUs if it isn't a number
+try:
+    OCR_CONCURRENCY = max(int(os.environ["OCR_CONCURRENCY"]), 1)
+except (KeyError, ValueError):
+    OCR_CONCURRENCY = os.cpu_count() or 1
+
+# MIME types of the usual uploads; anything else is sniffed with libmagic
+EXT_TO_MIME = {
+    ".pdf": "application/pdf",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+    ".bmp": "image/bmp",
+    ".gif": "image/gif",
+}
+
+
+_VALID_KEYS = frozenset({"first_page", "last_page", "output_format"})
+_VALID_FORMATS = frozenset({"xml", "text"})
+
+# Poppler commands for each output format, before the page and file arguments
+_CMD_TEMPLATE_TEXT = ("pdftotext",)
+_CMD_TEMPLATE_XML = ("pdftotext", "-bbox-layout")
+
+# A TessBaseAPI can only process one image at a time, so each thread gets its own
+_TESSERACT_LOCAL = threading.local()
+
 
 class SystemCallError(Exception):
     pass
@@ -27,22 +77,19 @@ class ConversionOptions:
         if options is None:
             options = {}
 
-        valid_keys = {"first_page", "last_page", "output_format"}
-        valid_formats = {"xml", "text"}
-
         for key in options.keys():
-            if key not in valid_keys:
+            if key not in _VALID_KEYS:
                 raise ValueError(f"Invalid option: {key}")
 
         self.first_page = options.get("first_page", 1)
         self.last_page = options.get("last_page", 1)
         self.output_format = options.get("output_format", "xml")  # Default to XML
 
-        if self.output_format not in valid_formats:
+        if self.output_format not in _VALID_FORMATS:
             raise ValueError(f"Invalid output format: {self.output_format}")
 
 
-def run_command_with_timeout(command, timeout):
+def run_command_with_timeout(command, timeout, capture_stdout: bool = False, env=None):
     """
     Runs a system command with a specified timeout. Raises SystemCallError if the command
     fails or returns a non-zero exit status.
@@ -50,16 +97,29 @@ def run_command_with_timeout(command, timeout):
     Parameters:
     - command (list): The command to execute and its arguments as a list.
     - timeout (int): The timeout in seconds.
+    - capture_stdout (bool): Whether to capture and return the command's output.
+      The conversion commands write their results to files, so by default stdout is
+      discarded instead of being buffered in memory.
+    - env (dict): The environment for the command. Defaults to the current environment
+      with OMP_ENV applied, so tesseract runs single-threaded under the page fan-out.
 
     Returns:
-    - The output of the command if successful.
+    - The output of the command if capture_stdout is set, otherwise None.
 
     Raises:
     - SystemCallError: If the command fails, times out, or returns a non-zero exit status.
     """
+    if env is None:
+        env = {**os.environ, **OMP_ENV}
     try:
         result = subprocess.run(
-            command, capture_output=True, text=True, check=True, timeout=timeout
+            command,
+            stdout=subprocess.PIPE if capture_stdout else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+            timeout=timeout,
+            env=env,
         )
         return result.stdout
     except TimeoutExpired as e:
@@ -67,7 +127,7 @@ def run_command_with_timeout(command, timeout):
             f"Command '{' '.join(command)}' timed out after {timeout} seconds"
         ) from e
     except CalledProcessError as e:
-        error_message = e.stderr.strip() if e.stderr else e.stdout.strip()
+        error_message = e.stderr.strip() if e.stderr else (e.stdout or "").strip()
         raise SystemCallError(
             f"Command '{' '.join(command)}' failed with exit status {e.returncode}: {error_message}"
         ) from e
@@ -105,7 +165,14 @@ def convert_image_to_pdf(
     # Tesseract adds ".pdf" to the output base name itself
     output_base = Path(output_pdf_path).with_suffix("")
 
-    command = ["tesseract", image_path, output_base, "pdf"]
+    if tesserocr is not None:
+        if _tesseract_api().ProcessPages(
+            str(output_base), image_path, timeout=timeout * 1000
+        ):
+            return output_pdf_path
+        # Fall back to the command line for anything the binding can't handle
+
+    command = ["tesseract", image_path, str(output_base), "pdf"]
 
     # Execute the command with a timeout
     run_command_with_timeout(command, timeout)
@@ -113,8 +180,38 @@ def convert_image_to_pdf(
     return output_pdf_path
 
 
+def _tesseract_api():
+    """
+    Returns the calling thread's tesserocr API that renders PDFs, initialized once per
+    thread so the language model is only loaded for that thread's first image.
+    """
+    api = getattr(_TESSERACT_LOCAL, "api", None)
+    if api is None:
+        api = tesserocr.PyTessBaseAPI(lang="eng")
+        api.SetVariable("tessedit_create_pdf", "1")
+        _TESSERACT_LOCAL.api = api
+    return api
+
+
+def pdf_page_count(pdf_filename: str, timeout: int = 30) -> int:
+    """
+    Returns the number of pages in a PDF file, using the Poppler `pdfinfo` command.
+
+    Raises:
+        SystemCallError: If `pdfinfo` fails or doesn't report a page count.
+    """
+    output = run_command_with_timeout(["pdfinfo", pdf_filename], timeout, capture_stdout=True)
+    for line in output.splitlines():
+        if line.startswith("Pages:"):
+            return int(line.split(":", 1)[1])
+    raise SystemCallError(f"Could not read the page count of {pdf_filename}")
+
+
 def pdf_to_text(
-    pdf_filename: str, conversion_options: ConversionOptions, timeout: int = 30
+    pdf_filename: str,
+    conversion_options: ConversionOptions,
+    timeout: int = 30,
+    output_filename: Optional[str] = None,
 ) -> str:
     """
     Converts a PDF file to a text file using the Poppler `pdftotext` command.
@@ -123,12 +220,31 @@ def pdf_to_text(
         pdf_filename (str): The path to the PDF file to convert.
         conversion_options (ConversionOptions): Options specifying the conversion details.
         timeout (int): The timeout in seconds for the `pdftotext` command.
+        output_filename (str, optional): The path where the text should be saved.
+        If not specified, the text is saved next to the PDF.
 
     Returns:
         str: The path to the generated text file.
     """
-    output_filename = pdf_filename.rsplit(".", 1)[0] + ".txt"
-    command = ["pdftotext"]
+    if output_filename is None:
+        output_filename = str(Path(pdf_filename).with_suffix(".txt"))
+
+    if pdftotext is not None:
+        try:
+            with open(pdf_filename, "rb") as pdf_file:
+                pdf = pdftotext.PDF(pdf_file)
+        except pdftotext.Error:
+            # Fall back to the command line for PDFs the binding can't open
+            pass
+        else:
+            first_page = conversion_options.first_page or 1
+            last_page = min(conversion_options.last_page or len(pdf), len(pdf))
+            # Like the pdftotext command, end every page with a form feed
+            pages = (pdf[page - 1] + "\f" for page in range(first_page, last_page + 1))
+            Path(output_filename).write_text("".join(pages))
+            return output_filename
+
+    command = list(_CMD_TEMPLATE_TEXT)
 
     if conversion_options.first_page:
         command.extend(["-f", str(conversion_options.first_page)])
@@ -145,26 +261,94 @@ def pdf_to_text(
         raise SystemCallError(f"Failed to convert {pdf_filename} to text: {str(e)}")
 
 
+def pdf_to_text_parallel(
+    pdf_filename: str,
+    conversion_options: ConversionOptions,
+    workers: Optional[int] = None,
+    timeout: int = 30,
+) -> str:
+    """
+    Converts a PDF file to a text file, running one `pdftotext` process per page
+    in parallel.
+
+    The page range comes from the conversion options, limited to the pages the PDF
+    actually has. Ranges shorter than PARALLEL_MIN_PAGES, a single worker, or the
+    in-process pdftotext binding being installed, fall back to a single `pdf_to_text`
+    call. The page count is only read with `pdfinfo` when the range could be split.
+
+    Args:
+        pdf_filename (str): The path to the PDF file to convert.
+        conversion_options (ConversionOptions): Options specifying the conversion details.
+        workers (int, optional): The number of pages to convert at once.
+        Defaults to OCR_CONCURRENCY.
+        timeout (int): The timeout in seconds for each `pdftotext` command.
+
+    Returns:
+        str: The path to the generated text file.
+    """
+    # The in-process binding has no process start-up cost to spread out
+    if pdftotext is not None:
+        return pdf_to_text(pdf_filename, conversion_options, timeout)
+
+    first_page = conversion_options.first_page or 1
+    last_page = conversion_options.last_page
+    if workers is None:
+        workers = OCR_CONCURRENCY
+
+    # A short explicit range isn't worth the extra pdfinfo process
+    if workers < 2 or (last_page and last_page - first_page + 1 < PARALLEL_MIN_PAGES):
+        return pdf_to_text(pdf_filename, conversion_options, timeout)
+
+    npages = pdf_page_count(pdf_filename, timeout)
+    pages = range(first_page, min(last_page or npages, npages) + 1)
+    workers = min(workers, len(pages))
+    if len(pages) < PARALLEL_MIN_PAGES:
+        return pdf_to_text(pdf_filename, conversion_options, timeout)
+
+    output_base = str(Path(pdf_filename).with_suffix(""))
+
+    def convert_page(page: int) -> str:
+        page_options = ConversionOptions({"first_page": page, "last_page": page})
+        return pdf_to_text(
+            pdf_filename, page_options, timeout, output_filename=f"{output_base}-{page}.txt"
+        )
+
+    # Each worker only waits on its pdftotext subprocess, so threads are enough
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        page_filenames = list(executor.map(convert_page, pages))
+
+    # pdftotext ends every page with a form feed, so the pages can just be joined
+    output_filename = output_base + ".txt"
+    with open(output_filename, "wb") as output_file:
+        for page_filename in page_filenames:
+            with open(page_filename, "rb") as page_file:
+                shutil.copyfileobj(page_file, output_file)
+            os.remove(page_filename)
+    return output_filename
+
+
 def pdf_to_xml(
     pdf_filename: str, conversion_options: ConversionOptions, timeout: int = 30
 ) -> str:
     """
-    Converts a PDF file to an XML file using the Poppler `pdftohtml` command.
+    Converts a PDF file to an XML file using the Poppler `pdftotext -bbox-layout` command.
+
+    The output is XHTML with the bounding box of every block, line and word.
 
     Args:
         pdf_filename (str): The path to the PDF file to convert.
         conversion_options (ConversionOptions): Options specifying the conversion details.
-        timeout (int): The timeout in seconds for the `pdftohtml` command.
+        timeout (int): The timeout in seconds for the `pdftotext` command.
 
     Returns:
         str: The path to the generated XML file.
 
     Raises:
-        SystemCallError: If the `pdftohtml` command fails, times out, or returns a non-zero
+        SystemCallError: If the `pdftotext` command fails, times out, or returns a non-zero
                          exit status.
     """
     output_filename = str(Path(pdf_filename).with_suffix(".xml"))
-    command = ["pdftohtml", "-xml"]
+    command = list(_CMD_TEMPLATE_XML)
 
     if conversion_options.first_page:
         command.extend(["-f", str(conversion_options.first_page)])
@@ -172,9 +356,7 @@ def pdf_to_xml(
     if conversion_options.last_page:
         command.extend(["-l", str(conversion_options.last_page)])
 
-    command.extend(
-        [pdf_filename, output_filename.replace(".xml", "")]
-    )  # pdftohtml adds .xml
+    command.extend([pdf_filename, output_filename])
 
     try:
         # Run the command with a timeout
@@ -203,8 +385,9 @@ def process_file(bucket_name: str, object_key: str, config: Dict[str, Any]):
     try:
         with tempfile.TemporaryDirectory() as temp_dir:
             input_file_path = download_file_from_s3(bucket_name, object_key, temp_dir)
-            mime = magic.Magic(mime=True)
-            mime_type = mime.from_file(input_file_path)
+            mime_type = EXT_TO_MIME.get(
+                Path(object_key).suffix.lower()
+            ) or magic.Magic(mime=True).from_file(input_file_path)
 
             if mime_type == "application/pdf" or mime_type.startswith("image/"):
                 # Convert to PDF first if it's an image
@@ -217,7 +400,7 @@ def process_file(bucket_name: str, object_key: str, config: Dict[str, Any]):
                         input_file_path, conversion_options
                     )
                 elif conversion_options.output_format == "text":
-                    temp_output_path = pdf_to_text(
+                    temp_output_path = pdf_to_text_parallel(
                         input_file_path, conversion_options
                     )
 
@@ -2,29 +2,96 @@
 S3 storage functions
 """
 
+import http.client
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from typing import BinaryIO, Optional
 
+import aioboto3
 import boto3
+from boto3.s3.transfer import TransferConfig
+import urllib3.connection
 from botocore.exceptions import ClientError
+from s3transfer.utils import S3_RETRYABLE_DOWNLOAD_ERRORS
 
+# Files over 16MB are transferred as concurrent 16MB parts, read and written to
+# disk in 1MB chunks
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=20,
+    io_chunksize=1024 * 1024,
+    use_threads=True,
+)
 
-def get_s3_client(region: str = ""):
+# delete_objects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+
+
+def _enlarge_http_blocksize(blocksize: int):
+    """
+    Raise the default block size HTTP connections use to send request bodies.
+
+    With the default (8KB in http.client, 16KB in urllib3 2.x) every multipart part is
+    written to the socket in many small sends, each re-acquiring the GIL.
+    """
+    http.client.HTTPConnection.__init__.__defaults__ = tuple(
+        blocksize if default == 8192 else default
+        for default in http.client.HTTPConnection.__init__.__defaults__
+    )
+    for connection_cls in (
+        urllib3.connection.HTTPConnection, urllib3.connection.HTTPSConnection
+    ):
+        kwdefaults = connection_cls.__init__.__kwdefaults__
+        if kwdefaults and "blocksize" in kwdefaults:
+            kwdefaults["blocksize"] = blocksize
+
+
+# Set POPOCR_LARGE_SOCKBUF=1 to patch the standard library defaults at import
+if os.environ.get("POPOCR_LARGE_SOCKBUF") == "1":
+    _enlarge_http_blocksize(1024 * 1024)
+
+
+def _s3_client_kwargs(region: str = "") -> dict:
+    """Return the keyword arguments used to create an S3 client."""
     if not region:
         region = "us-east-1"
     if "S3_ACCESS_KEY" in os.environ:
         # Connect to S3 in a local development environment
-        return boto3.client(
-            "s3",
-            endpoint_url=os.environ["S3_ENDPOINT_URL"],
-            aws_access_key_id=os.environ["S3_ACCESS_KEY"],
-            aws_secret_access_key=os.environ["S3_SECRET_KEY"],
-            region_name=region,
-            config=boto3.session.Config(signature_version="s3v4"),
-        )
-    else:
-        # Connect to AWS S3 in a production environment
-        return boto3.client("s3", region_name=region)
+        return {
+            "endpoint_url": os.environ["S3_ENDPOINT_URL"],
+            "aws_access_key_id": os.environ["S3_ACCESS_KEY"],
+            "aws_secret_access_key": os.environ["S3_SECRET_KEY"],
+            "region_name": region,
+            "config": boto3.session.Config(
+                signature_version="s3v4", max_pool_connections=50
+            ),
+        }
+    # Connect to AWS S3 in a production environment
+    return {
+        "region_name": region,
+        "config": boto3.session.Config(max_pool_connections=50),
+    }
+
+
+@lru_cache(maxsize=4)
+def _cached_s3_client(region: str, mode: str):
+    # mode is only part of the cache key, so switching environments gets a new client
+    return boto3.client("s3", **_s3_client_kwargs(region))
+
+
+def get_s3_client(region: str = ""):
+    """
+    Return an S3 client for the region, reusing the client (and its connection pool)
+    from earlier calls.
+    """
+    if not region:
+        region = "us-east-1"
+    mode = "local" if "S3_ACCESS_KEY" in os.environ else "prod"
+    return _cached_s3_client(region, mode)
 
 
 def create_bucket(bucket_name, region: str = ""):
@@ -59,22 +126,32 @@ def remove_bucket(bucket_name, region: str = ""):
     :param region: AWS region where the bucket is located. Defaults to 'us-east-1'.
     :return: True if the bucket was successfully removed, False otherwise.
     """
-    s3_resource = boto3.resource(
-        "s3",
-        endpoint_url=os.environ.get("S3_ENDPOINT_URL"),  # If using MinIO or custom S3
-        aws_access_key_id=os.environ.get("S3_ACCESS_KEY"),
-        aws_secret_access_key=os.environ.get("S3_SECRET_KEY"),
-        region_name=region if region else "us-east-1",
-    )
-
-    bucket = s3_resource.Bucket(bucket_name)
+    s3_client = get_s3_client(region)
 
     try:
-        # Delete all objects in the bucket
-        bucket.objects.all().delete()
+        # Each page lists at most 1000 keys, as many as one delete_objects accepts
+        paginator = s3_client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=bucket_name, PaginationConfig={"PageSize": DELETE_BATCH_SIZE}
+        )
+        for page in pages:
+            objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if not objects:
+                continue
+            response = s3_client.delete_objects(
+                Bucket=bucket_name, Delete={"Objects": objects, "Quiet": True}
+            )
+            # delete_objects succeeds even if some of the keys were not deleted
+            errors = response.get("Errors", [])
+            if errors:
+                print(
+                    f"Error: {len(errors)} objects could not be deleted from "
+                    f"'{bucket_name}': {errors[0]['Message']}"
+                )
+                return False
 
         # Now that the bucket is empty, delete the bucket itself
-        bucket.delete()
+        s3_client.delete_bucket(Bucket=bucket_name)
         print(
             f"Bucket '{bucket_name}' and its contents have been removed successfully."
         )
@@ -98,15 +175,44 @@ def upload_file_to_s3(
     """
     s3_client = get_s3_client(region)
     try:
-        s3_client.upload_file(file_path, bucket_name, object_name)
+        s3_client.upload_file(
+            file_path, bucket_name, object_name, Config=TRANSFER_CONFIG
+        )
         print(f"File {file_path} uploaded to {bucket_name}/{object_name}")
     except ClientError as e:
         print(f"Error: {e}")
         raise e
 
 
+async def upload_fileobj_to_s3(
+    fileobj: BinaryIO, bucket_name: str, object_name: str, region: str = ""
+):
+    """
+    Upload a file-like object to an S3 bucket without blocking the event loop.
+
+    :param fileobj: File-like object opened in binary mode, e.g. UploadFile.file
+    :param bucket_name: Bucket to upload to
+    :param object_name: S3 object name
+    :param region: AWS region where the bucket resides
+    """
+    session = aioboto3.Session()
+    async with session.client("s3", **_s3_client_kwargs(region)) as s3_client:
+        try:
+            await s3_client.upload_fileobj(
+                fileobj, bucket_name, object_name, Config=TRANSFER_CONFIG
+            )
+            print(f"File object uploaded to {bucket_name}/{object_name}")
+        except ClientError as e:
+            print(f"Error: {e}")
+            raise e
+
+
 def download_file_from_s3(
-    bucket_name: str, object_key: str, download_dir: str, region: str = ""
+    bucket_name: str,
+    object_key: str,
+    download_dir: str,
+    region: str = "",
+    byte_range: Optional[str] = None,
 ) -> str:
     """
     Download a file from S3 and return its local path.
@@ -116,6 +222,8 @@ def download_file_from_s3(
         object_key (str): The key of the object in the S3 bucket.
         download_dir (str): The directory where the file will be downloaded.
         region (str): The region where the bucket is located.
+        byte_range (str, optional): Only download these bytes of the object, as an
+        HTTP Range header value, e.g. "bytes=0-1023".
 
     Returns:
         str: The path to the downloaded or converted file.
@@ -126,6 +234,106 @@ def download_file_from_s3(
     # Construct the download path
     download_path = Path(download_dir) / Path(object_key).name
 
-    # Download the file
-    s3_client.download_file(bucket_name, object_key, download_path.as_posix())
-    return download_path.as_posix()
+    if byte_range:
+        # Download part of the file in a single request
+        response = s3_client.get_object(
+            Bucket=bucket_name, Key=object_key, Range=byte_range
+        )
+        with open(download_path, "wb") as local_file:
+            shutil.copyfileobj(response["Body"], local_file, length=1024 * 1024)
+        return download_path.as_posix()
+
+    head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    size = head["ContentLength"]
+    # Download large files as parallel range requests, small ones in a single request
+    if size > TRANSFER_CONFIG.multipart_threshold:
+        part_size = TRANSFER_CONFIG.multipart_chunksize
+    else:
+        part_size = max(size, 1)
+    return multipart_download(
+        bucket_name,
+        object_key,
+        download_path.as_posix(),
+        size=size,
+        etag=head["ETag"],
+        part_size=part_size,
+        region=region,
+    )
+
+
+def multipart_download(
+    bucket_name: str,
+    object_key: str,
+    download_path: str,
+    size: Optional[int] = None,
+    etag: Optional[str] = None,
+    part_size: int = TRANSFER_CONFIG.multipart_chunksize,
+    workers: int = 16,
+    region: str = "",
+) -> str:
+    """
+    Download a file from S3 as concurrent byte-range requests, each written straight
+    to its offset in the local file.
+
+    A part whose body fails mid-read is resumed from the last byte written, up to
+    TRANSFER_CONFIG.num_download_attempts times. If the download fails, the partly
+    written file is removed.
+
+    Args:
+        bucket_name (str): The name of the S3 bucket.
+        object_key (str): The key of the object in the S3 bucket.
+        download_path (str): The local path of the downloaded file.
+        size (int, optional): The size of the object, if already known.
+        etag (str, optional): The ETag of the object, if already known. Every part
+        is requested for this ETag, so a concurrent overwrite fails the download.
+        part_size (int): The number of bytes per request.
+        workers (int): The number of requests in flight at once.
+        region (str): The region where the bucket is located.
+
+    Returns:
+        str: The path to the downloaded file.
+    """
+    s3_client = get_s3_client(region)
+    if size is None or etag is None:
+        head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        size, etag = head["ContentLength"], head["ETag"]
+
+    def download_part(start: int):
+        end = min(start + part_size, size) - 1
+        offset = start
+        for attempt in range(TRANSFER_CONFIG.num_download_attempts):
+            if offset > end:
+                # The stream failed after its last byte had been written
+                return
+            try:
+                response = s3_client.get_object(
+                    Bucket=bucket_name,
+                    Key=object_key,
+                    Range=f"bytes={offset}-{end}",
+                    IfMatch=etag,
+                )
+                for chunk in response["Body"].iter_chunks(TRANSFER_CONFIG.io_chunksize):
+                    # pwrite may write less than it was given
+                    view = memoryview(chunk)
+                    while view:
+                        written = os.pwrite(fd, view, offset)
+                        view = view[written:]
+                        offset += written
+                return
+            except S3_RETRYABLE_DOWNLOAD_ERRORS:
+                if attempt == TRANSFER_CONFIG.num_download_attempts - 1:
+                    raise
+
+    fd = os.open(download_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() re-raises the first failed part
+            list(executor.map(download_part, range(0, size, part_size)))
+    except BaseException:
+        # The file already has its full size, so don't leave it looking complete
+        os.close(fd)
+        os.unlink(download_path)
+        raise
+    os.close(fd)
+    return download_path
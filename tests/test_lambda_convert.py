@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+# The Lambda handlers are standalone modules, not part of the popocr package
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "lambda"))
+from lambda_convert import binarize_image  # noqa: E402
+
+
+def test_binarize_transparent_png(tmp_path):
+    """Test that transparent pixels are binarized as white, not black."""
+    # Fully transparent black background, with an opaque black square in the middle
+    img = Image.new('RGBA', (100, 100), (0, 0, 0, 0))
+    img.paste((0, 0, 0, 255), (35, 35, 65, 65))
+    image_filename = str(tmp_path / 'transparent.png')
+    img.save(image_filename)
+
+    binary_filename = binarize_image(image_filename)
+
+    assert binary_filename == str(tmp_path / 'transparent-bw.tif')
+    with Image.open(binary_filename) as binary:
+        assert binary.mode == '1'
+        assert binary.getpixel((5, 5)) == 255
+        assert binary.getpixel((50, 50)) == 0
@@ -1,13 +1,27 @@
 import pytest
-from popocr.convert import run_command_with_timeout, SystemCallError
+from popocr import convert
+from popocr.convert import run_command_with_timeout, SystemCallError, ConversionOptions
 
 def test_successful_command():
     """Test that a successful command returns the correct output."""
     command = ['echo', 'hello']
     expected_output = 'hello\n'
-    output = run_command_with_timeout(command, 5)
+    output = run_command_with_timeout(command, 5, capture_stdout=True)
     assert output == expected_output
 
+def test_stdout_discarded_by_default():
+    """Test that the output is not captured unless requested."""
+    command = ['echo', 'hello']
+    output = run_command_with_timeout(command, 5)
+    assert output is None
+
+def test_omp_thread_limit_default():
+    """Test that commands run with OMP_THREAD_LIMIT=1 unless an env is given."""
+    command = ['sh', '-c', 'echo $OMP_THREAD_LIMIT']
+    assert run_command_with_timeout(command, 5, capture_stdout=True) == '1\n'
+    output = run_command_with_timeout(command, 5, capture_stdout=True, env={'OMP_THREAD_LIMIT': '4'})
+    assert output == '4\n'
+
 def test_timeout():
     """Test that the function raises an error when the command times out."""
     command = ['sleep', '2']  # Adjust sleep time if necessary to ensure timeout
@@ -29,3 +43,57 @@ def test_unexpected_error():
     with pytest.raises(SystemCallError) as excinfo:
         run_command_with_timeout(command, 5)
     assert 'An error occurred while executing command' in str(excinfo.value)
+
+def test_conversion_options_defaults():
+    """Test the default conversion options."""
+    options = ConversionOptions()
+    assert (options.first_page, options.last_page, options.output_format) == (1, 1, 'xml')
+
+def test_conversion_options_invalid():
+    """Test that unknown options and output formats are rejected."""
+    with pytest.raises(ValueError):
+        ConversionOptions({'dpi': 300})
+    with pytest.raises(ValueError):
+        ConversionOptions({'output_format': 'html'})
+
+@pytest.fixture
+def fake_poppler(monkeypatch):
+    """Replace the poppler commands with a fake 3-page PDF, recording each call."""
+    calls = []
+
+    def fake_run(command, timeout, capture_stdout=False, env=None):
+        calls.append(command)
+        if command[0] == 'pdfinfo':
+            return 'Title: test\nPages: 3\n'
+        page = command[command.index('-f') + 1]
+        with open(command[-1], 'w') as f:
+            f.write(f'page {page}\f')
+
+    monkeypatch.setattr(convert, 'run_command_with_timeout', fake_run)
+    monkeypatch.setattr(convert, 'pdftotext', None)
+    return calls
+
+def test_pdf_to_text_parallel_short_range(fake_poppler, tmp_path):
+    """Test that a short page range is converted without reading the page count."""
+    pdf_filename = str(tmp_path / 'test.pdf')
+    output = convert.pdf_to_text_parallel(pdf_filename, ConversionOptions(), workers=4)
+    assert [command[0] for command in fake_poppler] == ['pdftotext']
+    assert open(output).read() == 'page 1\f'
+
+def test_pdf_to_text_parallel_merges_pages(fake_poppler, tmp_path):
+    """Test that an open-ended range is split per page and merged in order."""
+    pdf_filename = str(tmp_path / 'test.pdf')
+    options = ConversionOptions({'last_page': None, 'output_format': 'text'})
+    output = convert.pdf_to_text_parallel(pdf_filename, options, workers=4)
+    assert output == str(tmp_path / 'test.txt')
+    assert [command[0] for command in fake_poppler] == ['pdfinfo'] + ['pdftotext'] * 3
+    assert open(output).read() == 'page 1\fpage 2\fpage 3\f'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['test.txt']
+
+def test_pdf_to_text_parallel_binding(fake_poppler, monkeypatch, tmp_path):
+    """Test that the in-process binding is used without running any command."""
+    monkeypatch.setattr(convert, 'pdftotext', object())
+    monkeypatch.setattr(convert, 'pdf_to_text', lambda pdf_filename, *args: 'binding.txt')
+    options = ConversionOptions({'last_page': None, 'output_format': 'text'})
+    assert convert.pdf_to_text_parallel(str(tmp_path / 'test.pdf'), options, workers=4) == 'binding.txt'
+    assert fake_poppler == []
@@ -1,20 +1,32 @@
+import asyncio
+import http.client
+import importlib
+import io
 import os
 from pathlib import Path
 
 import pytest
-import boto3
+import urllib3.connection
+from botocore.awsrequest import AWSHTTPSConnection
+from botocore.exceptions import ClientError, IncompleteReadError
 
+from popocr import storage
 from popocr.storage import (create_bucket, download_file_from_s3,
-                            remove_bucket, upload_file_to_s3)
+                            get_s3_client, multipart_download, remove_bucket,
+                            upload_file_to_s3, upload_fileobj_to_s3)
 
 # Set the test bucket name and region
 TEST_BUCKET_NAME = "test-bucket"
 TEST_REGION = "us-east-1"
 
-# Ensure MinIO or AWS credentials are set in environment variables
-S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
-S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY")
-S3_SECRET_KEY = os.getenv("S3_SECRET_KEY")
+
+@pytest.fixture(scope="module")
+def s3_client():
+    """
+    Fixture returning the shared S3 client used by the storage helpers.
+    """
+    return get_s3_client(TEST_REGION)
+
 
 @pytest.fixture(scope="module")
 def setup_s3_bucket():
@@ -33,7 +45,31 @@ def setup_s3_bucket():
     assert removed is True, "Failed to remove test bucket"
 
 
-def test_upload_file_to_s3(setup_s3_bucket, tmpdir):
+def test_get_s3_client_is_cached():
+    """
+    Test that repeated calls reuse the same client.
+    """
+    assert get_s3_client(TEST_REGION) is get_s3_client(TEST_REGION)
+    assert get_s3_client() is get_s3_client("us-east-1")
+
+
+def test_http_blocksize_enlarged(monkeypatch):
+    """
+    Test that S3 connections send request bodies in 1MB blocks with POPOCR_LARGE_SOCKBUF=1.
+    """
+    # Patch copies of the connection defaults, so they are restored after the test
+    monkeypatch.setattr(http.client.HTTPConnection.__init__, "__defaults__",
+                        http.client.HTTPConnection.__init__.__defaults__)
+    for connection_cls in (urllib3.connection.HTTPConnection, urllib3.connection.HTTPSConnection):
+        monkeypatch.setattr(connection_cls.__init__, "__kwdefaults__",
+                            dict(connection_cls.__init__.__kwdefaults__ or {}))
+
+    monkeypatch.setenv("POPOCR_LARGE_SOCKBUF", "1")
+    importlib.reload(storage)
+    assert AWSHTTPSConnection("example.com").blocksize == 1024 * 1024
+
+
+def test_upload_file_to_s3(setup_s3_bucket, s3_client, tmpdir):
     """
     Test uploading a file to S3.
     """
@@ -48,15 +84,29 @@ def test_upload_file_to_s3(setup_s3_bucket, tmpdir):
     upload_file_to_s3(str(test_file), TEST_BUCKET_NAME, s3_object_name, region=TEST_REGION)
 
     # Ensure file is uploaded
-    s3_client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL, 
-                             aws_access_key_id=S3_ACCESS_KEY,
-                             aws_secret_access_key=S3_SECRET_KEY,
-                             region_name=TEST_REGION)
     result = s3_client.head_object(Bucket=TEST_BUCKET_NAME, Key=s3_object_name)
     
     assert result['ResponseMetadata']['HTTPStatusCode'] == 200, "File was not uploaded to S3"
 
 
+def test_upload_fileobj_to_s3(setup_s3_bucket, tmpdir):
+    """
+    Test streaming a file object to S3.
+    """
+    s3_object_name = "test_upload_fileobj.txt"
+    test_file_content = "This is a test upload file object."
+
+    fileobj = io.BytesIO(test_file_content.encode())
+    asyncio.run(upload_fileobj_to_s3(fileobj, TEST_BUCKET_NAME, s3_object_name,
+                                     region=TEST_REGION))
+
+    # Download it again and check the content
+    download_path = download_file_from_s3(TEST_BUCKET_NAME, s3_object_name, str(tmpdir),
+                                          region=TEST_REGION)
+    downloaded_content = Path(download_path).read_text()
+    assert downloaded_content == test_file_content, "Uploaded content does not match"
+
+
 def test_download_file_from_s3(setup_s3_bucket, tmpdir):
     """
     Test downloading a file from S3.
@@ -78,3 +128,132 @@ def test_download_file_from_s3(setup_s3_bucket, tmpdir):
     downloaded_content = Path(download_path).read_text()
     assert downloaded_content == test_file_content, "Downloaded content does not match the uploaded file"
 
+
+def test_download_file_range_from_s3(setup_s3_bucket, tmpdir):
+    """
+    Test downloading part of a file from S3.
+    """
+    s3_object_name = "test_download_range.txt"
+    test_file_content = "This is a test download file."
+
+    test_file = tmpdir.join(s3_object_name)
+    test_file.write(test_file_content)
+    upload_file_to_s3(str(test_file), TEST_BUCKET_NAME, s3_object_name, region=TEST_REGION)
+
+    download_dir = tmpdir.mkdir("downloads")
+    download_path = download_file_from_s3(TEST_BUCKET_NAME, s3_object_name, str(download_dir),
+                                          region=TEST_REGION, byte_range="bytes=0-3")
+
+    downloaded_content = Path(download_path).read_text()
+    assert downloaded_content == test_file_content[:4], "Downloaded range does not match"
+
+
+def test_multipart_download(setup_s3_bucket, tmpdir):
+    """
+    Test downloading a file from S3 in several parts.
+    """
+    s3_object_name = "test_multipart_download.txt"
+    test_file_content = "This is a test download file, fetched a few bytes at a time."
+
+    test_file = tmpdir.join(s3_object_name)
+    test_file.write(test_file_content)
+    upload_file_to_s3(str(test_file), TEST_BUCKET_NAME, s3_object_name, region=TEST_REGION)
+
+    download_path = str(tmpdir.mkdir("downloads").join(s3_object_name))
+    multipart_download(TEST_BUCKET_NAME, s3_object_name, download_path, part_size=8,
+                       workers=4, region=TEST_REGION)
+
+    downloaded_content = Path(download_path).read_text()
+    assert downloaded_content == test_file_content, "Downloaded parts do not match the file"
+
+
+class FakeBody:
+    """
+    A streaming body that yields 4 bytes at a time, failing after fail_after bytes.
+    """
+    def __init__(self, data, fail_after=None):
+        self.data = data
+        self.fail_after = fail_after
+
+    def iter_chunks(self, chunk_size):
+        for start in range(0, len(self.data), 4):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise IncompleteReadError(actual_bytes=start, expected_bytes=len(self.data))
+            yield self.data[start:start + 4]
+
+
+class FakeS3Client:
+    """
+    An S3 client serving one object from memory, recording each requested range.
+    """
+    def __init__(self, data, get_body):
+        self.data = data
+        self.get_body = get_body
+        self.ranges = []
+
+    def get_object(self, Bucket, Key, Range, IfMatch):
+        self.ranges.append(Range)
+        start, end = (int(n) for n in Range[len("bytes="):].split("-"))
+        return {"Body": self.get_body(start, self.data[start:end + 1])}
+
+
+def test_multipart_download_resumes_part(monkeypatch, tmpdir):
+    """
+    Test that a part whose body fails mid-read is resumed from the last byte written.
+    """
+    data = b"0123456789abcdef"
+    failed = []
+
+    def get_body(start, part):
+        if start == 0 and not failed:
+            failed.append(start)
+            return FakeBody(part, fail_after=4)
+        return FakeBody(part)
+
+    s3_client = FakeS3Client(data, get_body)
+    monkeypatch.setattr(storage, "get_s3_client", lambda region="": s3_client)
+
+    download_path = str(tmpdir.join("resumed.txt"))
+    multipart_download(TEST_BUCKET_NAME, "resumed.txt", download_path, size=len(data),
+                       etag='"etag"', part_size=8, workers=1)
+
+    assert Path(download_path).read_bytes() == data
+    assert s3_client.ranges == ["bytes=0-7", "bytes=4-7", "bytes=8-15"]
+
+
+def test_multipart_download_short_writes(monkeypatch, tmpdir):
+    """
+    Test that parts are written completely when pwrite writes less than it is given.
+    """
+    data = b"0123456789abcdef"
+    s3_client = FakeS3Client(data, lambda start, part: FakeBody(part))
+    monkeypatch.setattr(storage, "get_s3_client", lambda region="": s3_client)
+
+    pwrite = os.pwrite
+    monkeypatch.setattr(os, "pwrite", lambda fd, chunk, offset: pwrite(fd, chunk[:3], offset))
+
+    download_path = str(tmpdir.join("short_writes.txt"))
+    multipart_download(TEST_BUCKET_NAME, "short_writes.txt", download_path, size=len(data),
+                       etag='"etag"', part_size=8, workers=2)
+
+    assert Path(download_path).read_bytes() == data
+
+
+def test_multipart_download_failure_removes_file(monkeypatch, tmpdir):
+    """
+    Test that a failed part doesn't leave a partly downloaded file behind.
+    """
+    def get_body(start, part):
+        if start == 8:
+            raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": "changed"}},
+                              "GetObject")
+        return FakeBody(part)
+
+    s3_client = FakeS3Client(b"0123456789abcdef", get_body)
+    monkeypatch.setattr(storage, "get_s3_client", lambda region="": s3_client)
+
+    download_path = str(tmpdir.join("failed.txt"))
+    with pytest.raises(ClientError):
+        multipart_download(TEST_BUCKET_NAME, "failed.txt", download_path, size=16,
+                           etag='"etag"', part_size=8, workers=2)
+    assert not Path(download_path).exists()